@@ -8,7 +8,7 @@ import sys
 import time
 from typing import Literal, Optional
 
-from lps.db import ensure_db, connect
+from lps.db import WINDOW_AGG_CTE, checkpoint_wal, ensure_db, connect, window_params
 from lps.export import export_csv as do_export_csv
 from lps.sampler import Sampler
 from lps.utils import parse_duration_to_seconds, parse_since_until
@@ -55,7 +55,7 @@ def main() -> None:
     p_vac.add_argument("--db", default="./lps.db")
     p_vac.set_defaults(func=cmd_vacuum)
 
-    p_reset = sub.add_parser("reset", help="清空数据（sample与process），并VACUUM")
+    p_reset = sub.add_parser("reset", help="删除并重建数据表（sample/process/sample_min），并VACUUM；运行中的采样器需先停止")
     p_reset.add_argument("--db", default="./lps.db")
     p_reset.set_defaults(func=cmd_reset)
 
@@ -109,78 +109,88 @@ def cmd_top(args: argparse.Namespace) -> None:
     since_ts = now_ts - window_s
 
     if group == "exe":
-        sql = """
+        sql = WINDOW_AGG_CTE + """
 SELECT
   COALESCE(p.exe_path, p.name, '<unknown>') AS key,
-  COUNT(*) AS samples,
-  SUM(s.delta_cpu_s) AS cpu_s,
-  SUM(s.dt_s) AS wall_s,
-  SUM(CASE WHEN s.active=1 THEN s.dt_s ELSE 0 END) AS active_wall_s,
-  CASE WHEN SUM(s.dt_s) > 0 THEN SUM(s.delta_cpu_s)/SUM(s.dt_s) ELSE NULL END AS avg_eff_cores,
-  AVG(s.rss_bytes) AS avg_rss
-FROM sample s
-JOIN process p ON p.id = s.process_id
-WHERE s.ts BETWEEN ? AND ?
+  SUM(w.samples) AS samples,
+  SUM(w.cpu_s) AS cpu_s,
+  SUM(w.wall_s) AS wall_s,
+  SUM(w.active_wall_s) AS active_wall_s,
+  CASE WHEN SUM(w.wall_s) > 0 THEN SUM(w.cpu_s)/SUM(w.wall_s) ELSE NULL END AS avg_eff_cores,
+  CASE WHEN SUM(w.wall_s) > 0 THEN 100.0*SUM(w.cpu_s)/SUM(w.wall_s) ELSE NULL END AS avg_cpu_percent
+FROM win w
+JOIN process p ON p.id = w.process_id
 GROUP BY COALESCE(p.exe_path, p.name, '<unknown>')
 ORDER BY cpu_s DESC
 LIMIT ?
 """
-        cur.execute(sql, (since_ts, now_ts, limit))
+        cur.execute(sql, (*window_params(conn, since_ts, now_ts), limit))
         rows = cur.fetchall()
         header = ("exe_or_name", "cpu_s", "avg_eff", "avg_cpu%", "active_s", "samples")
         print(f"{header[0]:<50} {header[1]:>10} {header[2]:>8} {header[3]:>8} {header[4]:>10} {header[5]:>8}")
         for r in rows:
-            avg_eff = r["avg_eff_cores"] or 0.0
             print(
-                f"{str(r['key'])[:50]:<50} {r['cpu_s'] or 0.0:>10.3f} {avg_eff:>8.3f} {(avg_eff*100):>8.1f} {(r['active_wall_s'] or 0):>10.1f} {r['samples'] or 0:>8}"
+                f"{str(r['key'])[:50]:<50} {r['cpu_s'] or 0.0:>10.3f} {r['avg_eff_cores'] or 0.0:>8.3f} {r['avg_cpu_percent'] or 0.0:>8.1f} {(r['active_wall_s'] or 0):>10.1f} {r['samples'] or 0:>8}"
             )
     else:
-        sql = """
+        # (pid, create_time) 在 process 中唯一，win 已按 process_id 聚合，无需再分组
+        sql = WINDOW_AGG_CTE + """
 SELECT
   printf('%d@%.0f', p.pid, p.create_time) AS key,
-  COUNT(*) AS samples,
-  MIN(p.exe_path) AS exe_path,
-  SUM(s.delta_cpu_s) AS cpu_s,
-  SUM(s.dt_s) AS wall_s,
-  SUM(CASE WHEN s.active=1 THEN s.dt_s ELSE 0 END) AS active_wall_s,
-  CASE WHEN SUM(s.dt_s) > 0 THEN SUM(s.delta_cpu_s)/SUM(s.dt_s) ELSE NULL END AS avg_eff_cores
-FROM sample s
-JOIN process p ON p.id = s.process_id
-WHERE s.ts BETWEEN ? AND ?
-GROUP BY p.pid, p.create_time
+  w.samples AS samples,
+  p.exe_path AS exe_path,
+  w.cpu_s AS cpu_s,
+  w.wall_s AS wall_s,
+  w.active_wall_s AS active_wall_s,
+  CASE WHEN w.wall_s > 0 THEN w.cpu_s/w.wall_s ELSE NULL END AS avg_eff_cores,
+  CASE WHEN w.wall_s > 0 THEN 100.0*w.cpu_s/w.wall_s ELSE NULL END AS avg_cpu_percent
+FROM win w
+JOIN process p ON p.id = w.process_id
 ORDER BY cpu_s DESC
 LIMIT ?
 """
-        cur.execute(sql, (since_ts, now_ts, limit))
+        cur.execute(sql, (*window_params(conn, since_ts, now_ts), limit))
         rows = cur.fetchall()
         header = ("pid@ctime", "cpu_s", "avg_eff", "avg_cpu%", "active_s", "samples")
         print(f"{header[0]:<22} {header[1]:>10} {header[2]:>8} {header[3]:>8} {header[4]:>10} {header[5]:>8}")
         for r in rows:
-            avg_eff = r["avg_eff_cores"] or 0.0
             print(
-                f"{str(r['key'])[:22]:<22} {r['cpu_s'] or 0.0:>10.3f} {avg_eff:>8.3f} {(avg_eff*100):>8.1f} {(r['active_wall_s'] or 0):>10.1f} {r['samples'] or 0:>8}"
+                f"{str(r['key'])[:22]:<22} {r['cpu_s'] or 0.0:>10.3f} {r['avg_eff_cores'] or 0.0:>8.3f} {r['avg_cpu_percent'] or 0.0:>8.1f} {(r['active_wall_s'] or 0):>10.1f} {r['samples'] or 0:>8}"
             )
 
 
 def cmd_vacuum(args: argparse.Namespace) -> None:
     db_path: str = args.db
     conn = connect(db_path)
-    cur = conn.cursor()
-    cur.execute("VACUUM")
-    conn.commit()
+    # VACUUM 不能在事务内执行，改为手动事务模式避免隐式 BEGIN
+    conn.isolation_level = None
+    conn.execute("VACUUM")
     print("VACUUM done.")
 
 
 def cmd_reset(args: argparse.Namespace) -> None:
     db_path: str = args.db
     conn = connect(db_path)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM sample")
-    cur.execute("DELETE FROM process")
-    conn.commit()
-    cur.execute("VACUUM")
-    conn.commit()
-    print("Database reset and vacuumed.")
+    conn.isolation_level = None
+    # 直接删表代替逐行 DELETE，耗时与库大小无关且不会撑大 WAL
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DROP TABLE IF EXISTS sample_min")
+        conn.execute("DROP TABLE IF EXISTS sample")
+        conn.execute("DROP TABLE IF EXISTS process")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.close()
+    # 重建表与索引
+    conn = ensure_db(db_path)
+    conn.isolation_level = None
+    # 先截断 WAL 再整理数据库文件
+    checkpoint_wal(conn)
+    conn.execute("VACUUM")
+    print("Database reset (tables dropped and recreated) and vacuumed. "
+          "Stop any running sampler before reuse; its open connection is now stale.")
 
 
 if __name__ == "__main__":
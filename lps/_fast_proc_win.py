@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+# Windows 批量进程快照：一次 NtQuerySystemInformation(SystemProcessInformation)
+# 取回所有进程的 pid/ppid/name/create_time/cpu/内存/IO，避免逐进程 OpenProcess。
+
+import ctypes
+from ctypes import wintypes
+from typing import Dict, List
+
+import psutil
+
+from lps.fastproc import pcputimes, pio, pmem
+
+SYSTEM_PROCESS_INFORMATION_CLASS = 5
+STATUS_INFO_LENGTH_MISMATCH = 0xC0000004
+
+# FILETIME(100ns, 自 1601-01-01) 与 Unix epoch 的差值
+_EPOCH_DELTA_100NS = 116444736000000000
+
+
+class _UNICODE_STRING(ctypes.Structure):
+    _fields_ = [
+        ("Length", wintypes.USHORT),
+        ("MaximumLength", wintypes.USHORT),
+        ("Buffer", ctypes.c_void_p),
+    ]
+
+
+class _SYSTEM_PROCESS_INFORMATION(ctypes.Structure):
+    _fields_ = [
+        ("NextEntryOffset", wintypes.ULONG),
+        ("NumberOfThreads", wintypes.ULONG),
+        ("WorkingSetPrivateSize", ctypes.c_longlong),
+        ("HardFaultCount", wintypes.ULONG),
+        ("NumberOfThreadsHighWatermark", wintypes.ULONG),
+        ("CycleTime", ctypes.c_ulonglong),
+        ("CreateTime", ctypes.c_longlong),
+        ("UserTime", ctypes.c_longlong),
+        ("KernelTime", ctypes.c_longlong),
+        ("ImageName", _UNICODE_STRING),
+        ("BasePriority", wintypes.LONG),
+        ("UniqueProcessId", ctypes.c_void_p),
+        ("InheritedFromUniqueProcessId", ctypes.c_void_p),
+        ("HandleCount", wintypes.ULONG),
+        ("SessionId", wintypes.ULONG),
+        ("UniqueProcessKey", ctypes.c_void_p),
+        ("PeakVirtualSize", ctypes.c_size_t),
+        ("VirtualSize", ctypes.c_size_t),
+        ("PageFaultCount", wintypes.ULONG),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+        ("PrivatePageCount", ctypes.c_size_t),
+        ("ReadOperationCount", ctypes.c_longlong),
+        ("WriteOperationCount", ctypes.c_longlong),
+        ("OtherOperationCount", ctypes.c_longlong),
+        ("ReadTransferCount", ctypes.c_longlong),
+        ("WriteTransferCount", ctypes.c_longlong),
+        ("OtherTransferCount", ctypes.c_longlong),
+    ]
+
+
+_ntdll = ctypes.WinDLL("ntdll")
+_NtQuerySystemInformation = _ntdll.NtQuerySystemInformation
+_NtQuerySystemInformation.argtypes = [wintypes.ULONG, ctypes.c_void_p, wintypes.ULONG, ctypes.POINTER(wintypes.ULONG)]
+_NtQuerySystemInformation.restype = wintypes.LONG
+
+# 跨 tick 复用的缓冲区，不够时按返回长度扩容
+_buf = ctypes.create_string_buffer(512 * 1024)
+
+
+def _query() -> ctypes.Array:
+    global _buf
+    ret_len = wintypes.ULONG(0)
+    while True:
+        status = _NtQuerySystemInformation(
+            SYSTEM_PROCESS_INFORMATION_CLASS, _buf, len(_buf), ctypes.byref(ret_len)
+        ) & 0xFFFFFFFF
+        if status == 0:
+            return _buf
+        if status != STATUS_INFO_LENGTH_MISMATCH:
+            raise OSError(f"NtQuerySystemInformation failed: 0x{status:08X}")
+        # 进程数在两次调用之间可能增长，多留余量
+        _buf = ctypes.create_string_buffer(max(len(_buf) * 2, ret_len.value + 64 * 1024))
+
+
+def snapshot(collect_mem: bool, collect_io: bool) -> List[Dict]:
+    """
+    返回所有进程的 info 字典列表（键与 psutil.Process.info 一致的子集）。
+    exe/cmdline/username 无法从该接口获得，由调用方按需补齐。
+    """
+    buf = _query()
+    base = ctypes.addressof(buf)
+    boot_time = None
+    out: List[Dict] = []
+    offset = 0
+    while True:
+        spi = _SYSTEM_PROCESS_INFORMATION.from_address(base + offset)
+        pid = spi.UniqueProcessId or 0
+        if pid in (0, 4) or not spi.CreateTime:
+            # 与 psutil 一致：Idle/System 进程的创建时间视为开机时间
+            if boot_time is None:
+                boot_time = psutil.boot_time()
+            create_time = boot_time
+        else:
+            create_time = (spi.CreateTime - _EPOCH_DELTA_100NS) / 10000000.0
+        if pid == 0:
+            name = "System Idle Process"
+        elif spi.ImageName.Buffer:
+            name = ctypes.wstring_at(spi.ImageName.Buffer, spi.ImageName.Length // 2)
+        else:
+            name = None
+        info = {
+            "pid": pid,
+            "name": name,
+            "create_time": create_time,
+            "ppid": spi.InheritedFromUniqueProcessId or 0,
+            "cpu_times": pcputimes(spi.UserTime / 10000000.0, spi.KernelTime / 10000000.0),
+        }
+        if collect_mem:
+            info["memory_info"] = pmem(spi.WorkingSetSize, spi.PagefileUsage)
+        if collect_io:
+            info["io_counters"] = pio(spi.ReadTransferCount, spi.WriteTransferCount)
+        out.append(info)
+        if not spi.NextEntryOffset:
+            break
+        offset += spi.NextEntryOffset
+    return out
@@ -1,22 +1,52 @@
 from __future__ import annotations
 import sqlite3
-from typing import Iterable, List, Optional, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import time
 
 PRAGMAS = (
+    # page_size 仅对空库生效，且必须在切换到 WAL 之前设置
+    ("page_size", "8192"),
     ("journal_mode", "WAL"),
     ("synchronous", "NORMAL"),
     ("temp_store", "MEMORY"),
     ("foreign_keys", "ON"),
+    # top/export 大范围聚合扫描：256MB mmap + 64MB 页缓存
+    ("mmap_size", "268435456"),
+    ("cache_size", "-65536"),
+    ("wal_autocheckpoint", "10000"),
 )
 
-def connect(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+# UPSERT ... RETURNING 需要 SQLite >= 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_UPSERT_PROCESS_SQL = """
+INSERT INTO process
+(pid, create_time, exe_path, name, cmdline, username, ppid, first_seen, last_seen, ended, partial_meta)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+ON CONFLICT(pid, create_time) DO UPDATE SET
+  last_seen=excluded.last_seen,
+  exe_path=COALESCE(exe_path, excluded.exe_path),
+  name=COALESCE(name, excluded.name),
+  cmdline=COALESCE(cmdline, excluded.cmdline),
+  username=COALESCE(username, excluded.username),
+  ppid=COALESCE(ppid, excluded.ppid),
+  partial_meta=(partial_meta OR excluded.partial_meta)
+"""
+_UPSERT_PROCESS_RETURNING_SQL = _UPSERT_PROCESS_SQL + "RETURNING id\n"
+
+# 语句缓存容量：mark_process_ended 等按参数个数拼接的 SQL 会产生大量不同文本，
+# 默认的 128 条容易把热路径的 UPSERT/INSERT 挤出缓存
+STATEMENT_CACHE_SIZE = 256
+
+def connect(db_path: str, *, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_path, check_same_thread=check_same_thread, cached_statements=STATEMENT_CACHE_SIZE
+    )
     conn.row_factory = sqlite3.Row
     return conn
 
-def ensure_db(db_path: str) -> sqlite3.Connection:
-    conn = connect(db_path)
+def ensure_db(db_path: str, *, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = connect(db_path, check_same_thread=check_same_thread)
     cur = conn.cursor()
     for key, val in PRAGMAS:
         try:
@@ -55,8 +85,22 @@ CREATE TABLE IF NOT EXISTS sample (
 );
 CREATE INDEX IF NOT EXISTS idx_process_exe_path ON process(exe_path);
 CREATE INDEX IF NOT EXISTS idx_process_ended ON process(ended);
-CREATE INDEX IF NOT EXISTS idx_sample_ts ON sample(ts);
+-- 覆盖索引：top/export 的时间窗聚合与按 ts 清理都无需回表；取代原先的 idx_sample_ts
+CREATE INDEX IF NOT EXISTS idx_sample_ts_cov ON sample(ts, process_id, active, dt_s, delta_cpu_s, rss_bytes);
+DROP INDEX IF EXISTS idx_sample_ts;
 CREATE INDEX IF NOT EXISTS idx_sample_process_ts ON sample(process_id, ts);
+-- 每进程每分钟汇总，长窗口 top/export 只需扫描完整分钟的汇总行
+CREATE TABLE IF NOT EXISTS sample_min (
+    minute_ts INTEGER NOT NULL,
+    process_id INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    sum_delta_cpu_s REAL NOT NULL,
+    sum_dt_s REAL NOT NULL,
+    sum_active_dt_s REAL NOT NULL,
+    sum_rss INTEGER,
+    rss_samples INTEGER NOT NULL,
+    PRIMARY KEY(minute_ts, process_id)
+) WITHOUT ROWID;
 """)
     conn.commit()
     return conn
@@ -73,40 +117,59 @@ def insert_or_get_process_id(
     ppid: Optional[int],
     now_ts: float,
     partial_meta: bool = False,
+    cur: Optional[sqlite3.Cursor] = None,
 ) -> int:
-    cur = conn.cursor()
-    cur.execute(
-        """
-INSERT INTO process
-(pid, create_time, exe_path, name, cmdline, username, ppid, first_seen, last_seen, ended, partial_meta)
-VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
-ON CONFLICT(pid, create_time) DO UPDATE SET
-  last_seen=excluded.last_seen,
-  exe_path=COALESCE(exe_path, excluded.exe_path),
-  name=COALESCE(name, excluded.name),
-  cmdline=COALESCE(cmdline, excluded.cmdline),
-  username=COALESCE(username, excluded.username),
-  ppid=COALESCE(ppid, excluded.ppid),
-  partial_meta=(partial_meta OR excluded.partial_meta)
-""",
-        (
-            pid,
-            create_time,
-            exe_path,
-            name,
-            cmdline,
-            username,
-            ppid,
-            now_ts,
-            now_ts,
-            1 if partial_meta else 0,
-        ),
+    # 允许调用方传入复用的游标（热路径上避免每次新建）
+    if cur is None:
+        cur = conn.cursor()
+    params = (
+        pid,
+        create_time,
+        exe_path,
+        name,
+        cmdline,
+        username,
+        ppid,
+        now_ts,
+        now_ts,
+        1 if partial_meta else 0,
     )
+    if HAS_RETURNING:
+        # 单条语句完成 UPSERT 并取回 id
+        cur.execute(_UPSERT_PROCESS_RETURNING_SQL, params)
+        row = cur.fetchone()
+        assert row is not None
+        return int(row[0])
+    cur.execute(_UPSERT_PROCESS_SQL, params)
     # fetch id
     cur.execute("SELECT id FROM process WHERE pid=? AND create_time=?", (pid, create_time))
     row = cur.fetchone()
     assert row is not None
-    return int(row["id"])
+    return int(row[0])
+
+def upsert_processes(
+    conn: sqlite3.Connection,
+    rows: Sequence[Tuple[int, float, Optional[str], Optional[str], Optional[str], Optional[str], Optional[int], float, float, int]],
+) -> Dict[Tuple[int, float], int]:
+    """
+    批量 UPSERT 进程元数据，行格式同 _UPSERT_PROCESS_SQL 的参数；
+    返回 {(pid, create_time): id}。需在调用方事务内执行。
+    """
+    if not rows:
+        return {}
+    cur = conn.cursor()
+    cur.executemany(_UPSERT_PROCESS_SQL, rows)
+    # 以临时表承载键集合，一次 JOIN（走 UNIQUE(pid, create_time) 索引）取回全部 id
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_keys(pid INTEGER, create_time REAL)")
+    cur.execute("DELETE FROM tmp_keys")
+    cur.executemany("INSERT INTO tmp_keys(pid, create_time) VALUES (?, ?)", (r[:2] for r in rows))
+    cur.execute(
+        "SELECT p.id, p.pid, p.create_time FROM tmp_keys k "
+        "JOIN process p ON p.pid = k.pid AND p.create_time = k.create_time"
+    )
+    ids = {(int(pid), float(ct)): int(process_id) for process_id, pid, ct in cur.fetchall()}
+    cur.execute("DELETE FROM tmp_keys")
+    return ids
 
 def batch_insert_samples(
     conn: sqlite3.Connection,
@@ -122,16 +185,170 @@ VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         rows,
     )
 
-def prune_old_samples(conn: sqlite3.Connection, cutoff_ts: float) -> int:
+def update_process_last_seen(conn: sqlite3.Connection, process_ids: Sequence[int], last_seen_ts: float) -> None:
+    if not process_ids:
+        return
+    cur = conn.cursor()
+    cur.executemany(
+        "UPDATE process SET last_seen=? WHERE id=?",
+        [(last_seen_ts, process_id) for process_id in process_ids],
+    )
+
+def prune_old_samples(conn: sqlite3.Connection, cutoff_ts: float, limit: Optional[int] = None) -> int:
+    """
+    删除 cutoff_ts 之前的样本与分钟汇总；给定 limit 时本次最多删除 limit 条样本，
+    返回值等于 limit 说明可能仍有剩余。
+    """
     cur = conn.cursor()
-    cur.execute("DELETE FROM sample WHERE ts < ?", (cutoff_ts,))
+    cur.execute("DELETE FROM sample_min WHERE minute_ts < ?", (minute_floor(cutoff_ts),))
+    if limit is None:
+        cur.execute("DELETE FROM sample WHERE ts < ?", (cutoff_ts,))
+    else:
+        # 子查询形式不依赖 SQLITE_ENABLE_UPDATE_DELETE_LIMIT
+        cur.execute(
+            "DELETE FROM sample WHERE id IN (SELECT id FROM sample WHERE ts < ? LIMIT ?)",
+            (cutoff_ts, limit),
+        )
     return cur.rowcount
 
+def checkpoint_wal(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def minute_floor(ts: float) -> int:
+    return int(ts // 60) * 60
+
+def rollup_watermark(conn: sqlite3.Connection) -> Optional[int]:
+    """
+    返回 sample_min 已汇总到的分钟边界（不含），尚无汇总时返回 None。
+    该边界之前的完整分钟均已汇总。
+    """
+    row = conn.execute("SELECT MAX(minute_ts) FROM sample_min").fetchone()
+    return None if row[0] is None else int(row[0]) + 60
+
+# 按分钟重算 [?, ?) 内的汇总；同一分钟重复执行结果不变
+_ROLLUP_SQL = """
+INSERT INTO sample_min
+(minute_ts, process_id, samples, sum_delta_cpu_s, sum_dt_s, sum_active_dt_s, sum_rss, rss_samples)
+SELECT
+  CAST(ts / 60 AS INTEGER) * 60,
+  process_id,
+  COUNT(*),
+  SUM(delta_cpu_s),
+  SUM(dt_s),
+  SUM(CASE WHEN active=1 THEN dt_s ELSE 0 END),
+  SUM(rss_bytes),
+  COUNT(rss_bytes)
+FROM sample
+WHERE ts >= ? AND ts < ?
+GROUP BY 1, 2
+ON CONFLICT(minute_ts, process_id) DO UPDATE SET
+  samples=excluded.samples,
+  sum_delta_cpu_s=excluded.sum_delta_cpu_s,
+  sum_dt_s=excluded.sum_dt_s,
+  sum_active_dt_s=excluded.sum_active_dt_s,
+  sum_rss=excluded.sum_rss,
+  rss_samples=excluded.rss_samples
+"""
+
+def rollup_sample_minutes(conn: sqlite3.Connection, until_ts: float, max_minutes: Optional[int] = None) -> bool:
+    """
+    将水位之后、until_ts 所在分钟之前的完整分钟从 sample 汇总进 sample_min。
+    首次运行时从最早样本开始回填，没有样本的区间直接跳过。
+    max_minutes 限制单次汇总的分钟跨度，避免在已有大量数据的库上长时间占用写事务。
+    返回是否已汇总到 until_ts 所在分钟。
+    """
+    end = minute_floor(until_ts)
+    start = rollup_watermark(conn)
+    if start is None:
+        row = conn.execute("SELECT MIN(ts) FROM sample").fetchone()
+    else:
+        row = conn.execute("SELECT MIN(ts) FROM sample WHERE ts >= ?", (start,)).fetchone()
+    if row[0] is None:
+        return True
+    start = minute_floor(row[0])
+    if start >= end:
+        return True
+    caught_up = True
+    if max_minutes is not None and start + max_minutes * 60 < end:
+        end = start + max_minutes * 60
+        caught_up = False
+    conn.execute(_ROLLUP_SQL, (start, end))
+    return caught_up
+
+def refresh_rollup_minute(conn: sqlite3.Connection, ts: float) -> int:
+    """
+    ts 所在分钟已低于水位（如系统时钟回拨后写入的样本）时重算该分钟的汇总，
+    否则该样本会被窗口查询漏掉。返回写入的汇总行数。
+    """
+    watermark = rollup_watermark(conn)
+    minute = minute_floor(ts)
+    if watermark is None or minute >= watermark:
+        return 0
+    cur = conn.cursor()
+    cur.execute(_ROLLUP_SQL, (minute, minute + 60))
+    return cur.rowcount
+
+# 时间窗内按 process_id 的聚合：完整且已汇总的分钟读 sample_min，首尾零散部分读 sample。
+# 参数由 window_params() 生成。
+WINDOW_AGG_CTE = """
+WITH parts(process_id, samples, cpu_s, wall_s, active_wall_s, rss_sum, rss_n) AS (
+  SELECT process_id, 1, delta_cpu_s, dt_s, CASE WHEN active=1 THEN dt_s ELSE 0 END, rss_bytes, rss_bytes IS NOT NULL
+  FROM sample WHERE ts >= ? AND ts < ?
+  UNION ALL
+  SELECT process_id, samples, sum_delta_cpu_s, sum_dt_s, sum_active_dt_s, sum_rss, rss_samples
+  FROM sample_min WHERE minute_ts >= ? AND minute_ts < ?
+  UNION ALL
+  SELECT process_id, 1, delta_cpu_s, dt_s, CASE WHEN active=1 THEN dt_s ELSE 0 END, rss_bytes, rss_bytes IS NOT NULL
+  FROM sample WHERE ts >= ? AND ts <= ?
+),
+win AS (
+  SELECT
+    process_id,
+    SUM(samples) AS samples,
+    SUM(cpu_s) AS cpu_s,
+    SUM(wall_s) AS wall_s,
+    SUM(active_wall_s) AS active_wall_s,
+    SUM(rss_sum) AS rss_sum,
+    SUM(rss_n) AS rss_n
+  FROM parts
+  GROUP BY process_id
+)"""
+
+def window_params(conn: sqlite3.Connection, since_ts: float, until_ts: float) -> Tuple[float, ...]:
+    """
+    为 WINDOW_AGG_CTE 计算绑定参数：[since, lo) 与 [hi, until] 读原始样本，
+    [lo, hi) 为窗口内且已汇总的完整分钟。
+    """
+    lo = minute_floor(since_ts)
+    if lo < since_ts:
+        lo += 60
+    hi = minute_floor(until_ts)
+    watermark = rollup_watermark(conn)
+    if watermark is None:
+        hi = lo
+    elif watermark < hi:
+        hi = watermark
+    if hi <= lo:
+        # 没有可用的完整分钟，全部读原始样本
+        lo = hi = since_ts
+    return (since_ts, lo, lo, hi, hi, until_ts)
+
+# 单条 UPDATE 绑定的 id 上限，超出部分分批执行（均在调用方事务内）
+MARK_ENDED_CHUNK = 500
+
 def mark_process_ended(conn: sqlite3.Connection, process_ids: Sequence[int], last_seen_ts: float) -> int:
     if not process_ids:
         return 0
-    placeholders = ",".join("?" for _ in process_ids)
-    sql = f"UPDATE process SET ended=1, last_seen=? WHERE id IN ({placeholders})"
     cur = conn.cursor()
-    cur.execute(sql, (last_seen_ts, *process_ids))
-    return cur.rowcount
\ No newline at end of file
+    # 以 WITH 开头的语句不被 sqlite3 识别为 DML，rowcount 恒为 -1，改用 total_changes 计数
+    before = conn.total_changes
+    for i in range(0, len(process_ids), MARK_ENDED_CHUNK):
+        chunk = process_ids[i : i + MARK_ENDED_CHUNK]
+        # VALUES 列表作为 CTE，按主键逐个查找而非对 IN 列表做扫描
+        values = "(" + "),(".join("?" for _ in chunk) + ")"
+        sql = (
+            f"WITH ids(id) AS (VALUES {values}) "
+            "UPDATE process SET ended=1, last_seen=? WHERE id IN (SELECT id FROM ids)"
+        )
+        cur.execute(sql, (*chunk, last_seen_ts))
+    return conn.total_changes - before
\ No newline at end of file
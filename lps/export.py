@@ -3,13 +3,15 @@ from __future__ import annotations
 import csv
 import sqlite3
 import time
-from typing import Literal, Optional
+from typing import Literal
 
-from lps.db import ensure_db
+from lps.db import WINDOW_AGG_CTE, ensure_db, window_params
 
 
 Group = Literal["exe", "pid"]
 
+_FETCH_CHUNK = 1000
+
 
 def export_csv(db_path: str, group: Group, since_ts: float, until_ts: float, out_path: str) -> int:
     """
@@ -20,25 +22,27 @@ def export_csv(db_path: str, group: Group, since_ts: float, until_ts: float, out
     """
     conn = ensure_db(db_path)
     cur = conn.cursor()
+    ff = "{:.6f}".format
+    since_s = ff(since_ts)
+    until_s = ff(until_ts)
 
     if group == "exe":
-        sql = """
+        sql = WINDOW_AGG_CTE + """
 SELECT
   COALESCE(p.exe_path, p.name) AS exe_path,
-  COUNT(*) AS samples,
-  SUM(s.delta_cpu_s) AS cpu_s,
-  SUM(s.dt_s) AS wall_s,
-  SUM(CASE WHEN s.active=1 THEN s.dt_s ELSE 0 END) AS active_wall_s,
-  CASE WHEN SUM(s.dt_s) > 0 THEN SUM(s.delta_cpu_s)/SUM(s.dt_s) ELSE NULL END AS avg_eff_cores,
-  AVG(s.rss_bytes) AS avg_rss
-FROM sample s
-JOIN process p ON p.id = s.process_id
-WHERE s.ts BETWEEN ? AND ?
+  SUM(w.samples) AS samples,
+  SUM(w.cpu_s) AS cpu_s,
+  SUM(w.wall_s) AS wall_s,
+  SUM(w.active_wall_s) AS active_wall_s,
+  CASE WHEN SUM(w.wall_s) > 0 THEN SUM(w.cpu_s)/SUM(w.wall_s) ELSE NULL END AS avg_eff_cores,
+  CASE WHEN SUM(w.wall_s) > 0 THEN 100.0*SUM(w.cpu_s)/SUM(w.wall_s) ELSE NULL END AS avg_cpu_percent,
+  CASE WHEN SUM(w.rss_n) > 0 THEN 1.0*SUM(w.rss_sum)/SUM(w.rss_n) ELSE NULL END AS avg_rss
+FROM win w
+JOIN process p ON p.id = w.process_id
 GROUP BY COALESCE(p.exe_path, p.name)
 ORDER BY cpu_s DESC
 """
-        cur.execute(sql, (since_ts, until_ts))
-        rows = cur.fetchall()
+        cur.execute(sql, window_params(conn, since_ts, until_ts))
         with open(out_path, "w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(
@@ -55,44 +59,48 @@ ORDER BY cpu_s DESC
                     "until_ts",
                 ]
             )
-            for r in rows:
-                avg_eff = r["avg_eff_cores"]
-                writer.writerow(
+            count = 0
+            # 分块从游标取行，格式化后交给 C 实现的 writerows；内存占用与结果行数无关
+            while True:
+                chunk = cur.fetchmany(_FETCH_CHUNK)
+                if not chunk:
+                    break
+                writer.writerows(
                     [
                         r["exe_path"],
                         r["samples"],
-                        _f(r["cpu_s"]),
-                        _f(r["wall_s"]),
-                        _f(r["active_wall_s"]),
-                        _f(avg_eff),
-                        _f((avg_eff or 0.0) * 100.0 if avg_eff is not None else None),
-                        _i(r["avg_rss"]),
-                        _f(since_ts),
-                        _f(until_ts),
+                        ff(r["cpu_s"] or 0.0),
+                        ff(r["wall_s"] or 0.0),
+                        ff(r["active_wall_s"] or 0.0),
+                        None if r["avg_eff_cores"] is None else ff(r["avg_eff_cores"]),
+                        None if r["avg_cpu_percent"] is None else ff(r["avg_cpu_percent"]),
+                        None if r["avg_rss"] is None else int(r["avg_rss"]),
+                        since_s,
+                        until_s,
                     ]
+                    for r in chunk
                 )
-        return len(rows)
+                count += len(chunk)
+        return count
 
     elif group == "pid":
-        sql = """
+        sql = WINDOW_AGG_CTE + """
 SELECT
   p.pid AS pid,
   p.create_time AS create_time,
-  MIN(COALESCE(p.exe_path, p.name)) AS exe_path,
-  COUNT(*) AS samples,
-  SUM(s.delta_cpu_s) AS cpu_s,
-  SUM(s.dt_s) AS wall_s,
-  SUM(CASE WHEN s.active=1 THEN s.dt_s ELSE 0 END) AS active_wall_s,
-  CASE WHEN SUM(s.dt_s) > 0 THEN SUM(s.delta_cpu_s)/SUM(s.dt_s) ELSE NULL END AS avg_eff_cores,
-  AVG(s.rss_bytes) AS avg_rss
-FROM sample s
-JOIN process p ON p.id = s.process_id
-WHERE s.ts BETWEEN ? AND ?
-GROUP BY p.pid, p.create_time
+  COALESCE(p.exe_path, p.name) AS exe_path,
+  w.samples AS samples,
+  w.cpu_s AS cpu_s,
+  w.wall_s AS wall_s,
+  w.active_wall_s AS active_wall_s,
+  CASE WHEN w.wall_s > 0 THEN w.cpu_s/w.wall_s ELSE NULL END AS avg_eff_cores,
+  CASE WHEN w.wall_s > 0 THEN 100.0*w.cpu_s/w.wall_s ELSE NULL END AS avg_cpu_percent,
+  CASE WHEN w.rss_n > 0 THEN 1.0*w.rss_sum/w.rss_n ELSE NULL END AS avg_rss
+FROM win w
+JOIN process p ON p.id = w.process_id
 ORDER BY cpu_s DESC
 """
-        cur.execute(sql, (since_ts, until_ts))
-        rows = cur.fetchall()
+        cur.execute(sql, window_params(conn, since_ts, until_ts))
         with open(out_path, "w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(
@@ -111,43 +119,31 @@ ORDER BY cpu_s DESC
                     "until_ts",
                 ]
             )
-            for r in rows:
-                avg_eff = r["avg_eff_cores"]
-                writer.writerow(
+            count = 0
+            # 分块从游标取行，格式化后交给 C 实现的 writerows；内存占用与结果行数无关
+            while True:
+                chunk = cur.fetchmany(_FETCH_CHUNK)
+                if not chunk:
+                    break
+                writer.writerows(
                     [
                         r["pid"],
-                        _f(r["create_time"]),
+                        ff(r["create_time"]),
                         r["exe_path"],
                         r["samples"],
-                        _f(r["cpu_s"]),
-                        _f(r["wall_s"]),
-                        _f(r["active_wall_s"]),
-                        _f(avg_eff),
-                        _f((avg_eff or 0.0) * 100.0 if avg_eff is not None else None),
-                        _i(r["avg_rss"]),
-                        _f(since_ts),
-                        _f(until_ts),
+                        ff(r["cpu_s"] or 0.0),
+                        ff(r["wall_s"] or 0.0),
+                        ff(r["active_wall_s"] or 0.0),
+                        None if r["avg_eff_cores"] is None else ff(r["avg_eff_cores"]),
+                        None if r["avg_cpu_percent"] is None else ff(r["avg_cpu_percent"]),
+                        None if r["avg_rss"] is None else int(r["avg_rss"]),
+                        since_s,
+                        until_s,
                     ]
+                    for r in chunk
                 )
-        return len(rows)
+                count += len(chunk)
+        return count
 
     else:
         raise ValueError("group must be 'exe' or 'pid'")
-
-
-def _f(v: Optional[float]) -> Optional[str]:
-    if v is None:
-        return None
-    try:
-        return f"{float(v):.6f}"
-    except Exception:
-        return None
-
-
-def _i(v: Optional[float]) -> Optional[int]:
-    if v is None:
-        return None
-    try:
-        return int(v)
-    except Exception:
-        return None
\ No newline at end of file
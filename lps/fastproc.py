@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import logging
+import os
+import sys
+from collections import namedtuple
+from typing import Container, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import psutil
+
+log = logging.getLogger(__name__)
+
+# 与 psutil 返回值同名字段的精简版本，采样器只按属性名读取
+pcputimes = namedtuple("pcputimes", ["user", "system"])
+pmem = namedtuple("pmem", ["rss", "vms"])
+pio = namedtuple("pio", ["read_bytes", "write_bytes"])
+
+# 批量快照拿不到的元数据，仅对新出现的会话通过 psutil 单独补齐
+_META_ATTRS = ["name", "exe", "cmdline", "username"]
+
+
+def iter_process_info(attrs: Sequence[str], known: Container[Tuple[int, float]] = ()) -> Iterator[Dict]:
+    """
+    枚举进程，产出与 psutil.Process.info 同形的字典。
+    优先使用平台批量快照（Windows: NtQuerySystemInformation；Linux: /proc 直读），
+    不可用时回退到 psutil.process_iter(attrs)。
+    known 中已有的 (pid, create_time) 不再补齐 exe/cmdline/username。
+    """
+    if _snapshot is not None:
+        try:
+            infos = _snapshot("memory_info" in attrs, "io_counters" in attrs)
+        except OSError as e:
+            log.debug("fast process snapshot failed, falling back to psutil: %s", e)
+        else:
+            for info in infos:
+                if (info["pid"], info["create_time"]) not in known:
+                    _fill_meta(info)
+                yield info
+            return
+    for proc in psutil.process_iter(attrs=list(attrs)):
+        yield proc.info
+
+
+def _fill_meta(info: Dict) -> None:
+    try:
+        meta = psutil.Process(info["pid"]).as_dict(attrs=_META_ATTRS, ad_value=None)
+    except psutil.Error:
+        meta = {}
+    for k in _META_ATTRS:
+        v = meta.get(k)
+        if v is not None or k not in info:
+            info[k] = v
+
+
+# ---- Linux: 直接扫描 /proc ----
+
+_PROC = "/proc"
+
+
+def _linux_boot_time() -> float:
+    with open(f"{_PROC}/stat", "rb") as f:
+        for line in f:
+            if line.startswith(b"btime"):
+                return float(line.split()[1])
+    raise OSError("btime not found in /proc/stat")
+
+
+def _read_io(pid: str) -> Optional[Tuple[int, int]]:
+    try:
+        with open(f"{_PROC}/{pid}/io", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    read_b = write_b = None
+    for line in data.splitlines():
+        if line.startswith(b"read_bytes:"):
+            read_b = int(line[11:])
+        elif line.startswith(b"write_bytes:"):
+            write_b = int(line[12:])
+    if read_b is None or write_b is None:
+        return None
+    return read_b, write_b
+
+
+def _linux_snapshot(collect_mem: bool, collect_io: bool) -> List[Dict]:
+    clk = _CLK_TCK
+    page = _PAGE_SIZE
+    boot_time = _linux_boot_time()
+    out: List[Dict] = []
+    with os.scandir(_PROC) as it:
+        for entry in it:
+            pid = entry.name
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"{_PROC}/{pid}/stat", "rb") as f:
+                    stat = f.read()
+                if collect_mem:
+                    with open(f"{_PROC}/{pid}/statm", "rb") as f:
+                        statm = f.read().split()
+            except OSError:
+                # 进程在枚举期间退出
+                continue
+            # comm 可能包含空格与括号，以最后一个 ')' 为界
+            lpar = stat.find(b"(")
+            rpar = stat.rfind(b")")
+            fields = stat[rpar + 2 :].split()
+            # fields[0] 为 state（stat 第 3 列），依次偏移
+            info = {
+                "pid": int(pid),
+                "name": stat[lpar + 1 : rpar].decode("utf-8", "replace"),
+                "create_time": float(fields[19]) / clk + boot_time,
+                "ppid": int(fields[1]),
+                "cpu_times": pcputimes(float(fields[11]) / clk, float(fields[12]) / clk),
+            }
+            if collect_mem:
+                info["memory_info"] = pmem(int(statm[1]) * page, int(statm[0]) * page)
+            if collect_io:
+                io = _read_io(pid)
+                info["io_counters"] = pio(*io) if io is not None else None
+            out.append(info)
+    return out
+
+
+def _load_snapshot():
+    try:
+        if sys.platform == "win32":
+            from lps import _fast_proc_win
+
+            return _fast_proc_win.snapshot
+        if sys.platform.startswith("linux") and os.path.isdir(_PROC):
+            return _linux_snapshot
+    except Exception as e:
+        log.debug("fast process snapshot unavailable: %s", e)
+    return None
+
+
+if sys.platform.startswith("linux"):
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+_snapshot = _load_snapshot()
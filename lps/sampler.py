@@ -1,19 +1,55 @@
 from __future__ import annotations
 
 import logging
+import queue
+import threading
 import time
-from typing import Dict, Iterable, List, Optional, Tuple
+from itertools import repeat
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import psutil
 
 from . import db as dbmod
+from . import fastproc
 from lps.utils import clamp
 
 log = logging.getLogger(__name__)
 
+# 写队列容量；连续多次入队时队列已满，说明写库跟不上，退回同步写库
+WRITE_QUEUE_SIZE = 4
+WRITE_QUEUE_FULL_LIMIT = 3
+
+# 过期样本分批删除，每次最多删除的行数；WAL 截断间隔
+PRUNE_BATCH_ROWS = 5000
+# 分钟汇总每次最多推进的分钟数（旧库首次回填时分多个 tick 完成）
+ROLLUP_BATCH_MINUTES = 10
+CHECKPOINT_INTERVAL_S = 600.0
+
+# 单次写库的新会话数达到该值时改用 executemany 批量 UPSERT（主要是启动基线）
+BULK_UPSERT_MIN = 32
 
 ProcKey = Tuple[int, float]  # (pid, create_time)
 
+# 每次枚举都需要的进程字段；内存/IO 按配置追加
+_BASE_ATTRS = ("pid", "name", "create_time", "exe", "cmdline", "username", "ppid", "cpu_times")
+
+
+class _TickWrite(NamedTuple):
+    """一次 tick 交给写库侧的数据：样本按列存放，进程以 ProcKey 引用。"""
+
+    ts: float
+    dt: float
+    new_meta: Dict[ProcKey, Dict[str, Any]]  # 尚未入库的会话元数据
+    keys: List[ProcKey]
+    delta: List[float]
+    eff: List[float]
+    active: List[int]
+    rss: List[Optional[int]]
+    vms: List[Optional[int]]
+    read: List[Optional[int]]
+    write: List[Optional[int]]
+    ended: List[ProcKey]
+
 
 class Sampler:
     def __init__(
@@ -34,14 +70,35 @@ class Sampler:
         self.retention_s = float(retention_s)
 
         self.cpu_count = max(1, psutil.cpu_count(logical=True) or 1)
-        self._conn = dbmod.ensure_db(self.db_path)
-
-        # 进程状态缓存
+        self._attrs = (
+            _BASE_ATTRS
+            + (("memory_info",) if self.collect_mem else ())
+            + (("io_counters",) if self.collect_io else ())
+        )
+        # 写连接：运行期由写线程独占，同步模式下由调用线程使用，任一时刻只有一个线程访问
+        self._conn = dbmod.ensure_db(self.db_path, check_same_thread=False)
+        # 手动管理事务：每个 tick 显式 BEGIN IMMEDIATE / COMMIT
+        self._conn.isolation_level = None
+        # 热路径复用的游标，避免每个进程创建/销毁一次
+        self._cur = self._conn.cursor()
+
+        # 采样侧状态
         self._prev_cpu: Dict[ProcKey, float] = {}  # total_cpu_time
-        self._procid: Dict[ProcKey, int] = {}  # DB process.id
         self._missing_ticks: Dict[ProcKey, int] = {}
         self._last_mono: Optional[float] = None
+
+        # 写库侧状态；_procid 只由写库侧修改，采样侧仅做成员判断
+        self._procid: Dict[ProcKey, int] = {}  # DB process.id
         self._last_cleanup_ts: float = 0.0
+        self._prune_pending = False
+        self._last_checkpoint_ts: float = 0.0
+        self._rollup_minute: Optional[int] = None
+        self._rollup_pending = False
+
+        # 后台写线程，None 表示同步写库
+        self._queue: "queue.Queue[Optional[_TickWrite]]" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._writer: Optional[threading.Thread] = None
+        self._queue_full_streak = 0
 
     def run_loop(self) -> None:
         """
@@ -57,6 +114,8 @@ class Sampler:
         )
         base = time.monotonic()
         tick_idx = 0
+        # 采样与写库分离：fsync/checkpoint 的延迟不再推迟下一次采样
+        self._start_writer()
         try:
             while True:
                 target = base + tick_idx * self.interval_s
@@ -64,34 +123,24 @@ class Sampler:
                 sleep_s = target - now
                 if sleep_s > 0:
                     time.sleep(sleep_s)
-                # 执行一次采样
+                # 执行一次采样（写库失败时事务已在 _write 内回滚）
                 try:
                     self.tick()
                 except Exception as e:
                     log.exception("tick failed: %s", e)
-                    # 确保前一次失败的事务被回滚，避免下一次循环处于脏事务状态
-                    try:
-                        if self._conn.in_transaction:
-                            self._conn.rollback()
-                    except Exception:
-                        pass
                 tick_idx += 1
         except KeyboardInterrupt:
             log.info("Sampler interrupted, exiting.")
+        finally:
+            self._stop_writer()
 
     def tick(self) -> None:
         """
-        单次采样：枚举进程，计算 Δcpu 与 eff_cores，批量写入样本。
+        单次采样：枚举进程，计算 Δcpu 与 eff_cores，交给写库侧批量写入样本。
         首次 tick 仅建立基线（不写样本）。
         """
         mono_now = time.monotonic()
         ts_now = time.time()
-        # 若上一次 tick 发生异常导致事务未回滚，这里进行清理，避免后续写库出错
-        try:
-            if self._conn.in_transaction:
-                self._conn.rollback()
-        except Exception:
-            pass
 
         # 第一次：建立基线，不写样本
         if self._last_mono is None:
@@ -103,26 +152,17 @@ class Sampler:
         dt = clamp(dt, 0.25, 5.0)
         self._last_mono = mono_now
 
-        rows = []  # type: List[Tuple[float,int,float,float,float,int,Optional[int],Optional[int],Optional[int],Optional[int]]]
+        # 按列（SoA）收集本 tick 的样本，ts/dt 对所有行相同不逐行存储
+        col_key: List[ProcKey] = []
+        col_delta: List[float] = []
+        col_rss: List[Optional[int]] = []
+        col_vms: List[Optional[int]] = []
+        col_read: List[Optional[int]] = []
+        col_write: List[Optional[int]] = []
         seen: Dict[ProcKey, float] = {}
+        new_meta: Dict[ProcKey, Dict[str, Any]] = {}
 
-        attrs = [
-            "pid",
-            "name",
-            "create_time",
-            "exe",
-            "cmdline",
-            "username",
-            "ppid",
-            "cpu_times",
-        ]
-        if self.collect_mem:
-            attrs.append("memory_info")
-        if self.collect_io:
-            attrs.append("io_counters")
-
-        for proc in psutil.process_iter(attrs=attrs):
-            info = proc.info
+        for info in fastproc.iter_process_info(self._attrs, self._procid):
             try:
                 pid = int(info.get("pid"))
                 create_time = float(info.get("create_time"))
@@ -131,21 +171,6 @@ class Sampler:
                 # 无法识别唯一键则跳过
                 continue
 
-            # 读取元数据
-            exe_path = _safe_str(info.get("exe"))
-            name = _safe_str(info.get("name"))
-            # cmdline 可能是 list or str
-            cmdline_val = info.get("cmdline")
-            if isinstance(cmdline_val, (list, tuple)):
-                cmdline = " ".join(map(str, cmdline_val))
-            else:
-                cmdline = _safe_str(cmdline_val)
-            username = _safe_str(info.get("username"))
-            try:
-                ppid = int(info.get("ppid")) if info.get("ppid") is not None else None
-            except Exception:
-                ppid = None
-
             # CPU 时间
             total_cpu = _cpu_total_seconds(info.get("cpu_times"))
             if total_cpu is None:
@@ -159,108 +184,273 @@ class Sampler:
             # 资源
             rss = vms = None  # type: Optional[int]
             if self.collect_mem:
-                try:
-                    mem = info.get("memory_info")
-                    if mem is not None:
-                        rss = int(getattr(mem, "rss", None)) if getattr(mem, "rss", None) is not None else None
-                        vms = int(getattr(mem, "vms", None)) if getattr(mem, "vms", None) is not None else None
-                except Exception:
-                    pass
+                mem = info.get("memory_info")
+                if mem is not None:
+                    try:
+                        rss = mem.rss
+                        vms = mem.vms
+                    except AttributeError:
+                        rss = vms = None
 
             read_b = write_b = None  # type: Optional[int]
             if self.collect_io:
+                io = info.get("io_counters")
+                if io is not None:
+                    try:
+                        read_b = io.read_bytes
+                        write_b = io.write_bytes
+                    except AttributeError:
+                        read_b = write_b = None
+
+            # 已入库的会话只需刷新 last_seen，元数据仅对新会话解析，由写库侧 UPSERT
+            if key not in self._procid:
+                # psutil 返回 str 或 None，空串按 None 处理
+                v = info.get("exe")
+                exe_path = v if isinstance(v, str) and v else None
+                v = info.get("name")
+                name = v if isinstance(v, str) and v else None
+                # cmdline 可能是 list or str
+                cmdline_val = info.get("cmdline")
+                if isinstance(cmdline_val, (list, tuple)):
+                    cmdline = " ".join(map(str, cmdline_val))
+                else:
+                    cmdline = cmdline_val if isinstance(cmdline_val, str) and cmdline_val else None
+                v = info.get("username")
+                username = v if isinstance(v, str) and v else None
                 try:
-                    io = info.get("io_counters")
-                    if io is not None:
-                        read_b = int(getattr(io, "read_bytes", None)) if getattr(io, "read_bytes", None) is not None else None
-                        write_b = int(getattr(io, "write_bytes", None)) if getattr(io, "write_bytes", None) is not None else None
+                    ppid = int(info.get("ppid")) if info.get("ppid") is not None else None
                 except Exception:
-                    pass
-
-            # process id in DB
-            process_id = dbmod.insert_or_get_process_id(
-                self._conn,
-                pid=pid,
-                create_time=create_time,
-                exe_path=exe_path,
-                name=name,
-                cmdline=cmdline,
-                username=username,
-                ppid=ppid,
-                now_ts=ts_now,
-                partial_meta=partial_meta,
-            )
-            self._procid[key] = process_id
+                    ppid = None
+                new_meta[key] = dict(
+                    exe_path=exe_path,
+                    name=name,
+                    cmdline=cmdline,
+                    username=username,
+                    ppid=ppid,
+                    partial_meta=partial_meta,
+                )
 
-            # 差分与活跃判断
+            # 差分
             if prev_total is None or total_cpu is None:
                 delta_cpu = 0.0
             else:
                 delta_cpu = max(0.0, float(total_cpu) - float(prev_total))
 
-            eff = delta_cpu / dt if dt > 0 else 0.0
-            # 合理上限，避免异常 spike
-            eff = min(eff, self.cpu_count * 1.5)
-            active = 1 if delta_cpu >= self.active_threshold * dt else 0
-
-            # 写行
-            rows.append(
-                (
-                    ts_now,
-                    process_id,
-                    dt,
-                    delta_cpu,
-                    eff,
-                    active,
-                    rss,
-                    vms,
-                    read_b,
-                    write_b,
-                )
-            )
+            # 按列追加
+            col_key.append(key)
+            col_delta.append(delta_cpu)
+            col_rss.append(rss)
+            col_vms.append(vms)
+            col_read.append(read_b)
+            col_write.append(write_b)
 
             # 更新基线
             if total_cpu is not None:
                 seen[key] = float(total_cpu)
 
-        # 写库
+        # 整列计算 eff_cores（合理上限，避免异常 spike）与活跃判断
+        eff_cap = self.cpu_count * 1.5
+        active_min = self.active_threshold * dt
+        col_eff = [min(d / dt, eff_cap) for d in col_delta]
+        col_active = [1 if d >= active_min else 0 for d in col_delta]
+
+        self._submit(
+            _TickWrite(
+                ts=ts_now,
+                dt=dt,
+                new_meta=new_meta,
+                keys=col_key,
+                delta=col_delta,
+                eff=col_eff,
+                active=col_active,
+                rss=col_rss,
+                vms=col_vms,
+                read=col_read,
+                write=col_write,
+                ended=self._handle_missing_and_ended(seen),
+            )
+        )
+
+    def _write(self, w: _TickWrite) -> None:
+        """
+        写库：新会话 UPSERT、刷新 last_seen、写样本、分钟汇总与结束标记在同一事务内完成，
+        随后按需清理过期样本。仅由写线程（同步模式下为调用线程）执行。
+        """
+        procid = self._procid
+        added: Dict[ProcKey, int] = {}
+        minute = dbmod.minute_floor(w.ts)
+        # 整个 tick 的 process UPSERT 与 sample 写入放在同一个显式事务中，只 fsync 一次
+        self._conn.execute("BEGIN IMMEDIATE")
         try:
-            dbmod.batch_insert_samples(self._conn, rows)
+            # 写线程滞后时同一会话可能被重复提交为新会话
+            new_keys = [key for key in w.new_meta if key not in procid]
+            if len(new_keys) >= BULK_UPSERT_MIN:
+                # 启动基线等大批新会话：executemany 一次写入，再一次查询取回 id
+                rows = []
+                for key in new_keys:
+                    meta = w.new_meta[key]
+                    rows.append(
+                        (
+                            key[0],
+                            key[1],
+                            meta["exe_path"],
+                            meta["name"],
+                            meta["cmdline"],
+                            meta["username"],
+                            meta["ppid"],
+                            w.ts,
+                            w.ts,
+                            1 if meta["partial_meta"] else 0,
+                        )
+                    )
+                added = dbmod.upsert_processes(self._conn, rows)
+            else:
+                for key in new_keys:
+                    added[key] = dbmod.insert_or_get_process_id(
+                        self._conn,
+                        pid=key[0],
+                        create_time=key[1],
+                        now_ts=w.ts,
+                        cur=self._cur,
+                        **w.new_meta[key],
+                    )
+            col_pid: List[int] = []
+            known_ids: List[int] = []
+            for key in w.keys:
+                process_id = added.get(key)
+                if process_id is None:
+                    process_id = procid.get(key)
+                    if process_id is None:
+                        # 采样侧入队时仍视为已知，但排队在前的写入已将其标记结束并移出缓存；
+                        # 按键 UPSERT 取回 id，库中已有元数据由 COALESCE 保留
+                        process_id = added[key] = dbmod.insert_or_get_process_id(
+                            self._conn,
+                            pid=key[0],
+                            create_time=key[1],
+                            exe_path=None,
+                            name=None,
+                            cmdline=None,
+                            username=None,
+                            ppid=None,
+                            now_ts=w.ts,
+                            cur=self._cur,
+                        )
+                    else:
+                        known_ids.append(process_id)
+                col_pid.append(process_id)
+
+            # 写库：zip 惰性拼行交给 executemany，不物化整个行列表
+            dbmod.update_process_last_seen(self._conn, known_ids, w.ts)
+            dbmod.batch_insert_samples(
+                self._conn,
+                zip(
+                    repeat(w.ts),
+                    col_pid,
+                    repeat(w.dt),
+                    w.delta,
+                    w.eff,
+                    w.active,
+                    w.rss,
+                    w.vms,
+                    w.read,
+                    w.write,
+                ),
+            )
+            # 进入新的一分钟或回填未完成时，把此前已完整的分钟汇总进 sample_min
+            rollup_pending = self._rollup_pending
+            if rollup_pending or minute != self._rollup_minute:
+                rollup_pending = not dbmod.rollup_sample_minutes(
+                    self._conn, w.ts, max_minutes=ROLLUP_BATCH_MINUTES
+                )
+            # 时钟回拨时样本可能落入已汇总的分钟，需重算该分钟
+            if w.keys:
+                dbmod.refresh_rollup_minute(self._conn, w.ts)
+            # 标记结束
+            ended_ids = [procid[key] for key in w.ended if key in procid]
+            dbmod.mark_process_ended(self._conn, ended_ids, w.ts)
             self._conn.commit()
         except Exception:
             self._conn.rollback()
             raise
-
-        # 标记丢失/结束
-        self._handle_missing_and_ended(seen, ts_now)
-
-        # 定期清理
-        if ts_now - self._last_cleanup_ts >= 60.0:
-            cutoff = ts_now - self.retention_s
+        # 提交后才更新 id 缓存，回滚时不会残留无效 id
+        procid.update(added)
+        for key in w.ended:
+            procid.pop(key, None)
+        self._rollup_minute = minute
+        self._rollup_pending = rollup_pending
+
+        # 定期清理：每次最多删一批，删满一批说明还有剩余，下一个 tick 继续
+        if self._prune_pending or w.ts - self._last_cleanup_ts >= 60.0:
+            cutoff = w.ts - self.retention_s
             try:
-                deleted = dbmod.prune_old_samples(self._conn, cutoff)
+                deleted = dbmod.prune_old_samples(self._conn, cutoff, limit=PRUNE_BATCH_ROWS)
                 if deleted:
                     log.debug("prune: deleted %d old samples older than %.0fs", deleted, self.retention_s)
+                self._prune_pending = deleted >= PRUNE_BATCH_ROWS
             except Exception as e:
                 log.warning("prune failed: %s", e)
-            self._last_cleanup_ts = ts_now
+                self._prune_pending = False
+            self._last_cleanup_ts = w.ts
+
+        # 定期截断 WAL，避免两次 checkpoint 之间无限增长
+        if w.ts - self._last_checkpoint_ts >= CHECKPOINT_INTERVAL_S:
+            try:
+                dbmod.checkpoint_wal(self._conn)
+            except Exception as e:
+                log.warning("wal checkpoint failed: %s", e)
+            self._last_checkpoint_ts = w.ts
+
+    def _submit(self, w: _TickWrite) -> None:
+        if self._writer is None:
+            self._write(w)
+            return
+        try:
+            self._queue.put_nowait(w)
+            self._queue_full_streak = 0
+            return
+        except queue.Full:
+            self._queue_full_streak += 1
+        if self._queue_full_streak >= WRITE_QUEUE_FULL_LIMIT:
+            log.warning(
+                "write queue full %d ticks in a row, falling back to synchronous writes",
+                self._queue_full_streak,
+            )
+            self._stop_writer()
+            self._write(w)
+        else:
+            self._queue.put(w)
+
+    def _start_writer(self) -> None:
+        if self._writer is not None:
+            return
+        self._queue_full_streak = 0
+        self._writer = threading.Thread(target=self._writer_loop, name="lps-writer", daemon=True)
+        self._writer.start()
+
+    def _stop_writer(self) -> None:
+        """发送结束标记，等待写线程写完队列中剩余的数据。"""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _writer_loop(self) -> None:
+        while True:
+            w = self._queue.get()
+            if w is None:
+                return
+            try:
+                self._write(w)
+            except Exception as e:
+                log.exception("write failed: %s", e)
 
     def _bootstrap_baseline(self, ts_now: float) -> None:
         """
-        首次采样：建立 prev_cpu 与 procid 映射，写入/更新 process 元数据，不写 sample。
+        首次采样：建立 prev_cpu 基线，写入/更新 process 元数据，不写 sample。
         """
-        attrs = [
-            "pid",
-            "name",
-            "create_time",
-            "exe",
-            "cmdline",
-            "username",
-            "ppid",
-            "cpu_times",
-        ]
-        for proc in psutil.process_iter(attrs=attrs):
-            info = proc.info
+        new_meta: Dict[ProcKey, Dict[str, Any]] = {}
+        for info in fastproc.iter_process_info(_BASE_ATTRS):
             try:
                 pid = int(info.get("pid"))
                 create_time = float(info.get("create_time"))
@@ -268,14 +458,18 @@ class Sampler:
             except Exception:
                 continue
 
-            exe_path = _safe_str(info.get("exe"))
-            name = _safe_str(info.get("name"))
+            # psutil 返回 str 或 None，空串按 None 处理
+            v = info.get("exe")
+            exe_path = v if isinstance(v, str) and v else None
+            v = info.get("name")
+            name = v if isinstance(v, str) and v else None
             cmdline_val = info.get("cmdline")
             if isinstance(cmdline_val, (list, tuple)):
                 cmdline = " ".join(map(str, cmdline_val))
             else:
-                cmdline = _safe_str(cmdline_val)
-            username = _safe_str(info.get("username"))
+                cmdline = cmdline_val if isinstance(cmdline_val, str) and cmdline_val else None
+            v = info.get("username")
+            username = v if isinstance(v, str) and v else None
             try:
                 ppid = int(info.get("ppid")) if info.get("ppid") is not None else None
             except Exception:
@@ -284,30 +478,44 @@ class Sampler:
             total_cpu = _cpu_total_seconds(info.get("cpu_times"))
             partial_meta = total_cpu is None
 
-            process_id = dbmod.insert_or_get_process_id(
-                self._conn,
-                pid=pid,
-                create_time=create_time,
+            new_meta[key] = dict(
                 exe_path=exe_path,
                 name=name,
                 cmdline=cmdline,
                 username=username,
                 ppid=ppid,
-                now_ts=ts_now,
                 partial_meta=partial_meta,
             )
-            self._procid[key] = process_id
             if total_cpu is not None:
                 self._prev_cpu[key] = float(total_cpu)
 
-    def _handle_missing_and_ended(self, seen: Dict[ProcKey, float], ts_now: float) -> None:
-        # 更新 prev_cpu 与 missing 计数
+        self._submit(
+            _TickWrite(
+                ts=ts_now,
+                dt=0.0,
+                new_meta=new_meta,
+                keys=[],
+                delta=[],
+                eff=[],
+                active=[],
+                rss=[],
+                vms=[],
+                read=[],
+                write=[],
+                ended=[],
+            )
+        )
+
+    def _handle_missing_and_ended(self, seen: Dict[ProcKey, float]) -> List[ProcKey]:
+        """
+        更新 prev_cpu 与缺失计数，返回判定为已结束的会话（由写库侧落盘 ended=1）。
+        """
         for key, total in seen.items():
             self._prev_cpu[key] = total
             self._missing_ticks.pop(key, None)
 
         # 对未见到的 key 累加缺失计数
-        ended_ids: List[int] = []
+        ended: List[ProcKey] = []
         for key in list(self._prev_cpu.keys()):
             if key not in seen:
                 cnt = self._missing_ticks.get(key, 0) + 1
@@ -316,39 +524,13 @@ class Sampler:
                     # 认为已结束
                     self._missing_ticks.pop(key, None)
                     self._prev_cpu.pop(key, None)
-                    pid = self._procid.pop(key, None)
-                    if pid is not None:
-                        ended_ids.append(pid)
-
-        if ended_ids:
-            try:
-                dbmod.mark_process_ended(self._conn, ended_ids, ts_now)
-                self._conn.commit()
-            except Exception as e:
-                self._conn.rollback()
-                log.warning("mark ended failed: %s", e)
+                    ended.append(key)
+        return ended
 
 
 def _cpu_total_seconds(cpu_times_obj) -> Optional[float]:
+    # psutil 的 cpu_times 总是带 user/system 的 namedtuple；不可访问时为 None
     try:
-        if cpu_times_obj is None:
-            return None
-        user = getattr(cpu_times_obj, "user", None)
-        system = getattr(cpu_times_obj, "system", None)
-        if user is None or system is None:
-            return None
-        return float(user) + float(system)
-    except Exception:
+        return cpu_times_obj.user + cpu_times_obj.system
+    except AttributeError:
         return None
-
-
-def _safe_str(v) -> Optional[str]:
-    try:
-        if v is None:
-            return None
-        s = str(v)
-        if not s:
-            return None
-        return s
-    except Exception:
-        return None
\ No newline at end of file
@@ -9,6 +9,11 @@ from typing import Optional, Tuple
 log = logging.getLogger(__name__)
 
 _DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdSMHD])\s*$")
+_ISO_RE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}")
+# fromisoformat 要求补零，未补零的写法（如 2025-9-2 1:2:3）由 strptime 兜底
+_ISO_FALLBACK_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+_UNIT_SECONDS = {"s": 1.0, "m": 60.0, "h": 3600.0, "d": 86400.0}
 
 
 def parse_duration_to_seconds(spec: str) -> float:
@@ -23,17 +28,7 @@ def parse_duration_to_seconds(spec: str) -> float:
     m = _DURATION_RE.match(spec)
     if not m:
         raise ValueError(f"Invalid duration spec: {spec!r}")
-    val = float(m.group(1))
-    unit = m.group(2).lower()
-    if unit == "s":
-        return val
-    if unit == "m":
-        return val * 60.0
-    if unit == "h":
-        return val * 3600.0
-    if unit == "d":
-        return val * 86400.0
-    raise ValueError(f"Invalid duration unit in spec: {spec!r}")
+    return float(m.group(1)) * _UNIT_SECONDS[m.group(2).lower()]
 
 
 def parse_time_point(spec: str, now_ts: Optional[float] = None) -> float:
@@ -46,39 +41,30 @@ def parse_time_point(spec: str, now_ts: Optional[float] = None) -> float:
     """
     if now_ts is None:
         now_ts = time.time()
-    s = spec.strip().lower()
-    if s == "now":
+    s = spec.strip()
+    if s.lower() == "now":
         return now_ts
     # 相对时间：X[s|m|h|d]，解释为 now - duration
-    try:
-        dur = parse_duration_to_seconds(s)
-        return now_ts - dur
-    except Exception:
-        pass
-
+    m = _DURATION_RE.match(s)
+    if m:
+        return now_ts - float(m.group(1)) * _UNIT_SECONDS[m.group(2).lower()]
+    # ISO 格式（视为本地时间）
+    if _ISO_RE.match(s):
+        try:
+            return _dt.datetime.fromisoformat(s).timestamp()
+        except ValueError:
+            pass
+        for fmt in _ISO_FALLBACK_FORMATS:
+            try:
+                return _dt.datetime.strptime(s, fmt).timestamp()
+            except ValueError:
+                continue
+        raise ValueError(f"Invalid time point spec: {spec!r}")
     # epoch（允许小数）
     try:
         return float(s)
-    except Exception:
-        pass
-
-    # ISO 格式
-    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-        try:
-            dt = _dt.datetime.strptime(spec, fmt)
-            # 视为本地时间
-            return dt.timestamp()
-        except Exception:
-            continue
-
-    # fromisoformat（更宽松）
-    try:
-        dt = _dt.datetime.fromisoformat(spec)
-        return dt.timestamp()
-    except Exception:
-        pass
-
-    raise ValueError(f"Invalid time point spec: {spec!r}")
+    except ValueError:
+        raise ValueError(f"Invalid time point spec: {spec!r}") from None
 
 
 def parse_since_until(